@@ -1,5 +1,7 @@
 import streamlit as st
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson.binary import Binary
 from dotenv import load_dotenv
 import os
 from datetime import datetime, date, timedelta
@@ -7,12 +9,14 @@ import pandas as pd
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.ensemble import IsolationForest
 import numpy as np
 import streamlit_authenticator as stauth
 import hashlib
-import cv2
+import bcrypt
+from PIL import Image
 from facenet_pytorch import MTCNN, InceptionResnetV1
 import torch
 import matplotlib.pyplot as plt
@@ -25,6 +29,11 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
 import io
 
+try:
+    import faiss
+except ImportError:  # Optional: face matching falls back to a NumPy matrix-vector product
+    faiss = None
+
 # Load environment variables
 load_dotenv()
 
@@ -32,23 +41,102 @@ load_dotenv()
 mongo_uri = os.getenv("MONGO_URI")
 db_name = os.getenv("DB_NAME")
 
-client = MongoClient(mongo_uri)
-db = client[db_name]
+@st.cache_resource(show_spinner=False)
+def get_db():
+    """Create the MongoDB client once per process and reuse it across reruns"""
+    client = MongoClient(
+        mongo_uri,
+        appname="employee-attendance",
+        maxPoolSize=50,
+        minPoolSize=4,
+        retryWrites=True,
+        compressors="zlib"
+    )
+    return client[db_name]
+
+db = get_db()
+client = db.client
 employees_col = db["employees"]
 attendance_col = db["attendance"]
 users_col = db["users"]
 leaves_col = db["leaves"]
 face_embeddings_col = db["face_embeddings"]
 
+@st.cache_resource(show_spinner=False)
+def ensure_indexes():
+    """Create the indexes backing employee lookups and attendance range queries"""
+    indexes = [
+        (employees_col, "employeeId", {"unique": True}),
+        (attendance_col, "date", {"unique": True}),
+        (attendance_col, [("date", 1), ("employees.employeeId", 1)], {}),
+        (attendance_col, "employees.employeeId", {}),
+        (face_embeddings_col, "employeeId", {"unique": True}),
+        (face_embeddings_col, "updated_at", {}),
+        (leaves_col, [("appliedAt", -1)], {}),
+        (leaves_col, [("employeeId", 1), ("appliedAt", -1)], {}),
+        (users_col, "username", {"unique": True})
+    ]
+    # A failure (e.g. existing duplicates blocking a unique index) must not stop the app
+    for col, keys, options in indexes:
+        try:
+            col.create_index(keys, **options)
+        except OperationFailure as e:
+            print(f"⚠️ Could not create index {keys} on {col.name}: {str(e)[:200]}")
+
+ensure_indexes()
+
+@st.cache_resource(show_spinner=False)
+def check_legacy_dates():
+    """Warn once per process while attendance documents still store string dates"""
+    legacy = attendance_col.count_documents({"date": {"$type": "string"}})
+    if legacy:
+        print(f"⚠️ {legacy} attendance documents still use string dates and are hidden from the app; run `python migrate_dates.py`")
+    return legacy
+
+check_legacy_dates()
+
+# Rows per page in the View Attendance table
+ATTENDANCE_PAGE_SIZE = 100
+
+# Rows per page in the Employee Management table
+EMPLOYEE_PAGE_SIZE = 100
+
+# Attendance statuses, in display order
+ATTENDANCE_STATUSES = ["Present", "Absent", "Leave", "Late"]
+
+# Departments and positions offered in the employee forms
+DEPARTMENTS = ("HR", "IT", "Finance", "Operations", "Marketing")
+DEPT_INDEX = {dept: i for i, dept in enumerate(DEPARTMENTS)}
+POSITIONS = ("Intern", "Junior", "Senior", "Manager", "Director")
+
 # Initialize face recognition models
 device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-mtcnn = MTCNN(keep_all=True, device=device)
-resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+
+@st.cache_resource(show_spinner="Loading face recognition models...")
+def get_face_models():
+    """Load MTCNN and FaceNet once per process instead of on every rerun"""
+    mtcnn = MTCNN(keep_all=True, device=device)
+    resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+    if device.type == 'cuda':
+        resnet = resnet.half()
+    elif hasattr(torch, "compile"):
+        # Inductor fuses conv/BN/ReLU on CPU; keep eager mode if compilation isn't available
+        try:
+            compiled = torch.compile(resnet)
+            with torch.inference_mode():
+                compiled(torch.zeros(1, 3, 160, 160))
+            resnet = compiled
+        except Exception as e:
+            print(f"⚠️ torch.compile failed, using eager FaceNet: {str(e)[:200]}")
+    return mtcnn, resnet
 
 # Streamlit App Configuration
 st.set_page_config(page_title="Employee Attendance System", layout="wide")
 st.title("📋 Employee Attendance System with AI")
 
+# Loaded after the page config so the spinner can show during the first (compiling) load
+mtcnn, resnet = get_face_models()
+
 # Initialize session states
 if 'add_form_key' not in st.session_state:
     st.session_state.add_form_key = 0
@@ -60,76 +148,269 @@ if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 
 # Helper Functions
-def send_email(to_email, subject, body):
-    """Send email notification"""
+def as_datetime(day):
+    """Convert a date to the midnight datetime stored in attendance documents"""
+    return datetime.combine(day, datetime.min.time())
+
+def date_range_filter(start_date, end_date):
+    """Build an inclusive MongoDB range filter on attendance dates"""
+    return {
+        "$gte": as_datetime(start_date),
+        "$lte": as_datetime(end_date)
+    }
+
+@st.cache_data(ttl=60)
+def load_employees():
+    """Load all employees (cached, cleared on employee writes)"""
+    return list(employees_col.find({}, {
+        "_id": 0, "employeeId": 1, "empName": 1, "email": 1, "mobile": 1,
+        "department": 1, "position": 1, "joinDate": 1
+    }))
+
+@st.cache_data(ttl=60)
+def load_employees_df():
+    """Build the employee table shown in Employee Management"""
+    return pd.DataFrame.from_records(
+        load_employees(),
+        columns=["employeeId", "empName", "email", "mobile", "department", "position", "joinDate"]
+    ).rename(columns={
+        "employeeId": "ID",
+        "empName": "Name",
+        "email": "Email",
+        "mobile": "Mobile",
+        "department": "Department",
+        "position": "Position",
+        "joinDate": "Join Date"
+    }).fillna({"Join Date": "N/A"}).astype({"Department": "category", "Position": "category"})
+
+@st.cache_data(ttl=60)
+def load_employee_ids():
+    """Load employee IDs only, read from the employeeId index"""
+    return tuple(employees_col.distinct("employeeId"))
+
+@st.cache_data(ttl=60)
+def load_attendance_rows(start_date, end_date, employee_id=None, page=1, page_size=ATTENDANCE_PAGE_SIZE):
+    """Load one page of attendance rows joined with employee details, plus the total row count"""
+    match = {"date": date_range_filter(start_date, end_date)}
+    if employee_id:
+        match["employees.employeeId"] = employee_id
+    
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"date": 1}},
+        {"$unwind": "$employees"}
+    ]
+    if employee_id:
+        pipeline.append({"$match": {"employees.employeeId": employee_id}})
+    # Count all rows but only join and return the requested page
+    pipeline.append({"$facet": {
+        "total": [{"$count": "n"}],
+        "rows": [
+            {"$skip": (page - 1) * page_size},
+            {"$limit": page_size},
+            {"$lookup": {
+                "from": "employees",
+                "localField": "employees.employeeId",
+                "foreignField": "employeeId",
+                "as": "emp"
+            }},
+            {"$unwind": "$emp"},
+            {"$project": {
+                "_id": 0,
+                "Date": "$date",
+                "ID": "$employees.employeeId",
+                "Name": "$emp.empName",
+                "Department": "$emp.department",
+                "Status": "$employees.status",
+                "Check-in": {"$ifNull": ["$employees.checkIn", "N/A"]},
+                "Check-out": {"$ifNull": ["$employees.checkOut", "N/A"]}
+            }}
+        ]
+    }})
+    result = next(attendance_col.aggregate(pipeline))
+    total = result["total"][0]["n"] if result["total"] else 0
+    columns = ["Date", "ID", "Name", "Department", "Status", "Check-in", "Check-out"]
+    df = pd.DataFrame(result["rows"], columns=columns)
+    # Narrow dtypes so repeated strings are dictionary-encoded when sent to the browser
+    df["Date"] = pd.to_datetime(df["Date"])
+    df = df.astype({"Department": "category", "Status": "category"})
+    return df, total
+
+@st.cache_data(ttl=60)
+def load_status_counts(start_date, end_date):
+    """Count attendance statuses per day on the server"""
+    pipeline = [
+        {"$match": {"date": date_range_filter(start_date, end_date)}},
+        {"$unwind": "$employees"},
+        {"$group": {
+            "_id": {"date": "$date", "status": "$employees.status"},
+            "n": {"$sum": 1}
+        }},
+        {"$project": {"_id": 0, "Date": "$_id.date", "Status": "$_id.status", "Count": "$n"}}
+    ]
+    return pd.DataFrame.from_records(attendance_col.aggregate(pipeline), columns=["Date", "Status", "Count"])
+
+@st.cache_data(ttl=60)
+def load_department_status(start_date, end_date):
+    """Count attendance statuses per department on the server"""
+    pipeline = [
+        {"$match": {"date": date_range_filter(start_date, end_date)}},
+        {"$unwind": "$employees"},
+        {"$lookup": {
+            "from": "employees",
+            "localField": "employees.employeeId",
+            "foreignField": "employeeId",
+            "as": "emp"
+        }},
+        {"$unwind": "$emp"},
+        {"$group": {
+            "_id": {"department": "$emp.department", "status": "$employees.status"},
+            "n": {"$sum": 1}
+        }},
+        {"$project": {"_id": 0, "Department": "$_id.department", "Status": "$_id.status", "Count": "$n"}}
+    ]
+    dept_df = pd.DataFrame.from_records(attendance_col.aggregate(pipeline), columns=["Department", "Status", "Count"])
+    if dept_df.empty:
+        return pd.DataFrame()
+    
+    dept_df["Status"] = dept_df["Status"].astype(pd.CategoricalDtype(ATTENDANCE_STATUSES))
+    return dept_df.pivot_table(
+        index="Department", columns="Status", values="Count",
+        aggfunc="sum", fill_value=0, observed=True
+    )
+
+def clear_employee_caches():
+    """Drop cached reads that depend on employee documents"""
+    load_employees.clear()
+    load_employees_df.clear()
+    load_employee_ids.clear()
+    load_attendance_rows.clear()
+    load_department_status.clear()
+
+def clear_attendance_caches():
+    """Drop cached reads that depend on attendance documents"""
+    load_attendance_rows.clear()
+    load_status_counts.clear()
+    load_department_status.clear()
+
+def remove_employee(employee_id):
+    """Delete an employee and pull them from the attendance documents that reference them"""
+    def _remove(session):
+        employees_col.delete_one({"employeeId": employee_id}, session=session)
+        attendance_col.update_many(
+            {"employees.employeeId": employee_id},
+            {"$pull": {"employees": {"employeeId": employee_id}}},
+            session=session
+        )
+    
     try:
-        smtp_server = os.getenv("SMTP_SERVER")
-        smtp_port = int(os.getenv("SMTP_PORT"))
-        smtp_username = os.getenv("SMTP_USERNAME")
-        smtp_password = os.getenv("SMTP_PASSWORD")
-        
-        msg = MIMEMultipart()
-        msg['From'] = smtp_username
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        st.error(f"Error sending email: {e}")
-        return False
+        with client.start_session() as session:
+            session.with_transaction(_remove)
+    except OperationFailure as e:
+        # Standalone servers do not support transactions
+        if e.code != 20:
+            raise
+        _remove(None)
+
+def build_email(to_email, subject, body):
+    """Build a plain-text email message"""
+    msg = MIMEMultipart()
+    msg['From'] = os.getenv("SMTP_USERNAME")
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+def smtp_connect():
+    """Open an authenticated SMTP connection"""
+    server = smtplib.SMTP(os.getenv("SMTP_SERVER"), int(os.getenv("SMTP_PORT")))
+    server.starttls()
+    server.login(os.getenv("SMTP_USERNAME"), os.getenv("SMTP_PASSWORD"))
+    return server
+
+def send_emails(messages, max_workers=10):
+    """Send messages concurrently and return the error (or None) for each one"""
+    # smtplib connections aren't thread-safe, so each worker logs in once and reuses its own
+    local = threading.local()
+    connections = []
+    
+    def send(msg):
+        if not hasattr(local, "server"):
+            local.server = smtp_connect()
+            connections.append(local.server)
+        local.server.send_message(msg)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(send, msg) for msg in messages]
+        errors = [future.exception() for future in futures]
+    
+    for server in connections:
+        try:
+            server.quit()
+        except smtplib.SMTPException:
+            pass
+    return errors
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def get_anomaly_model(employee_id, data_hash, _data):
+    """Train an Isolation Forest once per employee history (keyed on a hash of the features)"""
+    clf = IsolationForest(n_estimators=100, contamination=0.1, n_jobs=-1)
+    return clf.fit(_data)
 
 def detect_attendance_anomalies(employee_id):
     """Use Isolation Forest to detect attendance anomalies"""
-    # Get employee's attendance history
-    records = list(attendance_col.find({"employees.employeeId": employee_id}))
-    
-    if len(records) < 10:  # Need sufficient data
+    # Get only this employee's entries from their attendance history
+    pipeline = [
+        {"$match": {"employees.employeeId": employee_id}},
+        {"$unwind": "$employees"},
+        {"$match": {"employees.employeeId": employee_id}},
+        {"$project": {
+            "_id": 0,
+            "status": "$employees.status",
+            "checkIn": "$employees.checkIn",
+            "checkOut": "$employees.checkOut"
+        }}
+    ]
+    df = pd.DataFrame.from_records(attendance_col.aggregate(pipeline), columns=["status", "checkIn", "checkOut"])
+    
+    if len(df) < 10:  # Need sufficient data
         return None
     
-    # Prepare data for anomaly detection
-    data = []
-    for record in records:
-        for emp_record in record["employees"]:
-            if emp_record["employeeId"] == employee_id:
-                status = 1 if emp_record["status"] in ["Present", "Late"] else 0
-                check_in = emp_record.get("checkIn", "00:00")
-                check_out = emp_record.get("checkOut", "00:00")
-                
-                # Convert time to minutes since midnight
-                def time_to_minutes(t):
-                    h, m = map(int, t.split(':'))
-                    return h * 60 + m
-                
-                in_min = time_to_minutes(check_in)
-                out_min = time_to_minutes(check_out)
-                work_duration = out_min - in_min if out_min > in_min else 0
-                
-                data.append([status, in_min, work_duration])
+    # Convert HH:MM times to minutes since midnight (missing times count as 00:00)
+    def time_to_minutes(times):
+        parsed = pd.to_datetime(times, format="%H:%M", errors="coerce")
+        return (parsed.dt.hour * 60 + parsed.dt.minute).fillna(0).to_numpy()
     
-    # Train anomaly detection model
-    clf = IsolationForest(contamination=0.1)
-    preds = clf.fit_predict(data)
+    # Prepare data for anomaly detection
+    status = df["status"].isin(["Present", "Late"]).to_numpy(dtype=int)
+    in_min = time_to_minutes(df["checkIn"])
+    out_min = time_to_minutes(df["checkOut"])
+    work_duration = np.clip(out_min - in_min, 0, None)
+    data = np.column_stack([status, in_min, work_duration])
+    
+    # Reuse the trained model until the employee's history changes
+    data_hash = hashlib.md5(data.tobytes()).hexdigest()
+    clf = get_anomaly_model(employee_id, data_hash, data)
+    preds = clf.predict(data)
     anomalies = [i for i, x in enumerate(preds) if x == -1]
     
     return anomalies if anomalies else None
 
 def hash_password(password):
-    """Hash password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password using bcrypt with a per-user salt"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12))
 
 def verify_password(password, hashed_password):
     """Verify password against hashed password"""
-    return hash_password(password) == hashed_password
+    if isinstance(hashed_password, str):
+        # Accounts created before bcrypt store an unsalted SHA-256 hex digest
+        return hashlib.sha256(password.encode()).hexdigest() == hashed_password
+    return bcrypt.checkpw(password.encode(), hashed_password)
 
 def create_user(username, password, role):
     """Create a new user with hashed password"""
-    if users_col.find_one({"username": username}):
+    if users_col.find_one({"username": username}, {"_id": 1}):
         return False, "Username already exists"
     
     hashed_password = hash_password(password)
@@ -143,8 +424,15 @@ def create_user(username, password, role):
 
 def authenticate_user(username, password):
     """Authenticate user and return role if successful"""
-    user = users_col.find_one({"username": username})
+    user = users_col.find_one(
+        {"username": username},
+        {"username": 1, "password": 1, "role": 1, "employeeId": 1}
+    )
     if user and verify_password(password, user["password"]):
+        # Upgrade legacy SHA-256 hashes to bcrypt on successful login
+        if isinstance(user["password"], str):
+            users_col.update_one({"_id": user["_id"]}, {"$set": {"password": hash_password(password)}})
+        user.pop("password")
         return True, user["role"], user
     return False, None, None
 
@@ -172,7 +460,7 @@ def login_page():
                     st.error("Invalid username or password")
     
     # Add admin registration form
-    if not users_col.find_one({"role": "admin"}):
+    if not users_col.find_one({"role": "admin"}, {"_id": 1}):
         st.markdown("---")
         st.subheader("Create Admin Account")
         with st.form("admin_registration"):
@@ -200,148 +488,171 @@ def logout():
     st.session_state.current_user = None
     st.rerun()
 
-def get_face_embedding(image):
-    """Get face embedding from image using FaceNet"""
+def get_face_embedding(images):
+    """Get a face embedding from one or more same-sized RGB images using FaceNet"""
     try:
-        # Detect face
-        boxes, _ = mtcnn.detect(image)
-        if boxes is None:
-            return None
-        
-        # Get face embedding
-        face = mtcnn(image)
-        if face is None:
-            return None
+        with torch.inference_mode():
+            # Keep the batch on the host: MTCNN moves it to its device for detection,
+            # but crops faces through numpy, which fails on CUDA tensors
+            batch = torch.from_numpy(np.stack(images))
             
-        # Get embedding
-        embedding = resnet(face.unsqueeze(0).to(device))
-        return embedding.detach().cpu().numpy()
+            # MTCNN detects and returns aligned face crops for the whole batch in a single pass
+            faces = mtcnn(batch)
+            faces = [face[0] for face in faces if face is not None]
+            if not faces:
+                return None
+            
+            # Embed every detected face in one forward pass
+            batch = torch.stack(faces).to(device, dtype=torch.float16 if device.type == 'cuda' else torch.float32)
+            embeddings = resnet(batch).float().cpu().numpy()
+        
+        # Median across images smooths out blur and pose noise
+        return np.median(embeddings, axis=0, keepdims=True)
     except Exception as e:
         st.error(f"Error in face recognition: {e}")
         return None
 
+def capture_face_image(label, key):
+    """Return a newly taken webcam picture as an RGB array, or None"""
+    img_file = st.camera_input(label, key=key)
+    
+    # The widget returns the last picture on every rerun; process each picture once
+    if img_file is None or st.session_state.get(f"{key}_processed") == img_file.file_id:
+        return None
+    st.session_state[f"{key}_processed"] = img_file.file_id
+    return np.array(Image.open(img_file).convert("RGB"))
+
 def register_face(employee_id):
     """Register employee's face"""
     st.subheader("Register Face")
     st.info("Please look directly at the camera")
     
-    # Initialize webcam
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        st.error("Could not open webcam")
+    image = capture_face_image("Capture Face", key="register_face_camera")
+    if image is None:
         return
     
-    # Create a placeholder for the video feed
-    video_placeholder = st.empty()
-    
-    # Capture button
-    capture_button = st.button("Capture Face")
-    captured = False
-    
-    while not captured:
-        ret, frame = cap.read()
-        if not ret:
-            st.error("Failed to capture frame")
-            break
-            
-        # Convert BGR to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Display the frame
-        video_placeholder.image(frame_rgb, channels="RGB")
+    # Get face embedding
+    embedding = get_face_embedding([image])
+    if embedding is not None:
+        # Save embedding to database
+        face_embeddings_col.update_one(
+            {"employeeId": employee_id},
+            {"$set": {
+                "embedding": Binary(embedding.astype(np.float32).tobytes()),
+                "dim": embedding.size,
+                "updated_at": datetime.now()
+            }},
+            upsert=True
+        )
+        st.success("Face registered successfully!")
+    else:
+        st.error("No face detected. Please try again.")
+
+@st.cache_resource
+def get_embedding_cache():
+    """Process-wide holder for the face embedding matrix"""
+    return {"mat": None, "ids": None, "index": None, "mtime": None}
+
+def decode_embedding(stored):
+    """Decode a stored embedding (raw float32 bytes, or a list from older registrations)"""
+    if isinstance(stored, bytes):
+        return np.frombuffer(stored, dtype=np.float32)
+    return np.asarray(stored, dtype=np.float32).ravel()
+
+def load_face_embeddings():
+    """Return the cached embedding matrix, aligned employee IDs and FAISS index (if available)"""
+    cache = get_embedding_cache()
+    
+    # Reload only when an embedding has been added or updated since the last load
+    latest = face_embeddings_col.find_one({}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)])
+    mtime = latest.get("updated_at") if latest else None
+    if cache["mat"] is None or cache["mtime"] != mtime:
+        records = list(face_embeddings_col.find({}, {"_id": 0, "employeeId": 1, "embedding": 1}))
+        mat = np.asarray([decode_embedding(r["embedding"]) for r in records], dtype=np.float32).reshape(-1, 512)
+        mat /= np.linalg.norm(mat, axis=1, keepdims=True)
         
-        if capture_button:
-            # Get face embedding
-            embedding = get_face_embedding(frame_rgb)
-            if embedding is not None:
-                # Save embedding to database
-                face_embeddings_col.update_one(
-                    {"employeeId": employee_id},
-                    {"$set": {
-                        "embedding": embedding.tolist(),
-                        "updated_at": datetime.now()
-                    }},
-                    upsert=True
-                )
-                st.success("Face registered successfully!")
-                captured = True
-            else:
-                st.error("No face detected. Please try again.")
+        # Inner product on unit vectors is cosine similarity
+        index = None
+        if faiss is not None:
+            index = faiss.IndexFlatIP(512)
+            if device.type == 'cuda' and hasattr(faiss, "StandardGpuResources"):
+                index = faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, index)
+            index.add(mat)
+        cache.update(mat=mat, ids=[r["employeeId"] for r in records], index=index, mtime=mtime)
+    
+    return cache
+
+def match_face(embedding):
+    """Return the employee ID whose registered face best matches the embedding, or None"""
+    cache = load_face_embeddings()
+    ids = cache["ids"]
+    if not ids:
+        return None
     
-    cap.release()
+    q = embedding.astype(np.float32).reshape(-1, 512)[:1].copy()
+    q /= np.linalg.norm(q)
+    if cache["index"] is not None:
+        scores, indices = cache["index"].search(q, 1)
+        score, idx = scores[0, 0], indices[0, 0]
+    else:
+        scores = cache["mat"] @ q[0]
+        idx = scores.argmax()
+        score = scores[idx]
+    
+    # Cosine similarity > 0.5 is the same as distance < 1.0 between unit vectors
+    return ids[idx] if score > 0.5 else None
 
 def mark_attendance_by_face():
     """Mark attendance using face recognition"""
     st.subheader("Mark Attendance by Face")
     st.info("Please look directly at the camera")
     
-    # Initialize webcam
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        st.error("Could not open webcam")
+    image = capture_face_image("Mark Attendance", key="mark_attendance_camera")
+    if image is None:
         return
     
-    # Create a placeholder for the video feed
-    video_placeholder = st.empty()
+    # Get face embedding
+    embedding = get_face_embedding([image])
+    if embedding is None:
+        st.error("No face detected. Please try again.")
+        return
     
-    # Capture button
-    capture_button = st.button("Mark Attendance")
-    captured = False
+    # Find matching employee
+    best_match = match_face(embedding)
+    if not best_match:
+        st.error("No matching face found in database")
+        return
     
-    while not captured:
-        ret, frame = cap.read()
-        if not ret:
-            st.error("Failed to capture frame")
-            break
-            
-        # Convert BGR to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Display the frame
-        video_placeholder.image(frame_rgb, channels="RGB")
-        
-        if capture_button:
-            # Get face embedding
-            embedding = get_face_embedding(frame_rgb)
-            if embedding is not None:
-                # Find matching employee
-                best_match = None
-                best_distance = float('inf')
-                
-                for record in face_embeddings_col.find():
-                    stored_embedding = np.array(record["embedding"])
-                    distance = np.linalg.norm(embedding - stored_embedding)
-                    if distance < best_distance:
-                        best_distance = distance
-                        best_match = record["employeeId"]
-                
-                if best_match and best_distance < 1.0:  # Threshold for face matching
-                    # Mark attendance
-                    today = date.today().strftime("%Y-%m-%d")
-                    current_time = datetime.now().strftime("%H:%M")
-                    
-                    attendance_col.update_one(
-                        {"date": today},
-                        {"$push": {
-                            "employees": {
-                                "employeeId": best_match,
-                                "status": "Present",
-                                "checkIn": current_time,
-                                "checkOut": None
-                            }
-                        }},
-                        upsert=True
-                    )
-                    
-                    employee = employees_col.find_one({"employeeId": best_match})
-                    st.success(f"Attendance marked for {employee['empName']}!")
-                    captured = True
-                else:
-                    st.error("No matching face found in database")
-            else:
-                st.error("No face detected. Please try again.")
+    # Mark attendance
+    today = as_datetime(date.today())
+    current_time = datetime.now().strftime("%H:%M")
     
-    cap.release()
+    employee = employees_col.find_one({"employeeId": best_match}, {"_id": 0, "empName": 1})
+    
+    # Make sure today's document exists without relying on the unique date index,
+    # then push only if the employee isn't already in it
+    attendance_col.update_one(
+        {"date": today},
+        {"$setOnInsert": {"employees": [], "markedAt": datetime.now()}},
+        upsert=True
+    )
+    result = attendance_col.update_one(
+        {"date": today, "employees.employeeId": {"$ne": best_match}},
+        {"$push": {
+            "employees": {
+                "employeeId": best_match,
+                "status": "Present",
+                "checkIn": current_time,
+                "checkOut": None
+            }
+        }}
+    )
+    if result.matched_count == 0:
+        st.info(f"Attendance already marked today for {employee['empName']}")
+        return
+    clear_attendance_caches()
+    
+    st.success(f"Attendance marked for {employee['empName']}!")
 
 def apply_leave():
     """Employee leave application form"""
@@ -386,16 +697,29 @@ def manage_leaves():
     st.subheader("Manage Leave Applications")
     
     # Get all leave applications
-    leaves = list(leaves_col.find().sort("appliedAt", -1))
+    leaves = list(leaves_col.find({}, {
+        "employeeId": 1, "leaveType": 1, "startDate": 1, "endDate": 1,
+        "numDays": 1, "reason": 1, "status": 1
+    }).sort("appliedAt", -1))
     
     if not leaves:
         st.info("No leave applications found")
     else:
+        # Fetch the applicants in one query instead of one lookup per application
+        applicant_ids = list({leave["employeeId"] for leave in leaves})
+        employees = {
+            emp["employeeId"]: emp
+            for emp in employees_col.find(
+                {"employeeId": {"$in": applicant_ids}},
+                {"_id": 0, "employeeId": 1, "empName": 1}
+            )
+        }
+        
         # Display leave applications
         for leave in leaves:
             with st.expander(f"Leave Application - {leave['employeeId']}"):
-                employee = employees_col.find_one({"employeeId": leave["employeeId"]})
-                st.write(f"**Employee:** {employee['empName']}")
+                employee = employees.get(leave["employeeId"], {})
+                st.write(f"**Employee:** {employee.get('empName', 'N/A')}")
                 st.write(f"**Leave Type:** {leave['leaveType']}")
                 st.write(f"**Start Date:** {leave['startDate']}")
                 st.write(f"**End Date:** {leave['endDate']}")
@@ -436,6 +760,9 @@ def view_my_leaves():
     if st.session_state.user_role == "employee":
         leaves = list(leaves_col.find({
             "employeeId": st.session_state.current_user["employeeId"]
+        }, {
+            "_id": 0, "leaveType": 1, "startDate": 1, "endDate": 1, "numDays": 1,
+            "reason": 1, "status": 1, "approvedBy": 1, "approvedAt": 1
         }).sort("appliedAt", -1))
         
         if not leaves:
@@ -453,103 +780,84 @@ def view_my_leaves():
                         st.write(f"**Processed By:** {leave['approvedBy']}")
                         st.write(f"**Processed At:** {leave['approvedAt']}")
 
-def generate_attendance_analytics():
+@st.fragment
+def generate_attendance_analytics(key_prefix):
     """Generate attendance analytics and visualizations"""
     st.subheader("Attendance Analytics")
     
-    # Initialize session state for analytics if not exists
-    if 'analytics_counter' not in st.session_state:
-        st.session_state.analytics_counter = 0
-    st.session_state.analytics_counter += 1
-    
     # Date range selection
     col1, col2 = st.columns(2)
     start_date = col1.date_input(
         "Start Date", 
         date.today() - timedelta(days=30), 
-        key=f"analytics_dashboard_start_date_{st.session_state.analytics_counter}"
+        key=f"{key_prefix}_analytics_start_date"
     )
     end_date = col2.date_input(
         "End Date", 
         date.today(), 
-        key=f"analytics_dashboard_end_date_{st.session_state.analytics_counter}"
+        key=f"{key_prefix}_analytics_end_date"
     )
     
     # Store dates in session state
     st.session_state.analytics_start_date = start_date
     st.session_state.analytics_end_date = end_date
     
-    # Get attendance data
-    attendance_records = list(attendance_col.find({
-        "date": {
-            "$gte": start_date.strftime("%Y-%m-%d"),
-            "$lte": end_date.strftime("%Y-%m-%d")
-        }
-    }))
+    if st.button("Refresh", key=f"{key_prefix}_analytics_refresh"):
+        load_status_counts.clear()
+        load_department_status.clear()
     
-    if not attendance_records:
+    # Get per-day status counts
+    status_df = load_status_counts(start_date, end_date)
+    
+    if status_df.empty:
         st.info("No attendance records found for the selected period")
         return
     
-    # Process data for analytics
-    attendance_data = []
-    for record in attendance_records:
-        for emp_record in record["employees"]:
-            attendance_data.append({
-                "Date": record["date"],
-                "EmployeeID": emp_record["employeeId"],
-                "Status": emp_record["status"],
-                "CheckIn": emp_record.get("checkIn", "N/A"),
-                "CheckOut": emp_record.get("checkOut", "N/A")
-            })
-    
-    df = pd.DataFrame(attendance_data)
-    
     # Display analytics
     st.write("### Attendance Overview")
     
     # Status distribution
-    status_counts = df["Status"].value_counts()
+    status_counts = status_df.groupby("Status")["Count"].sum()
     fig1 = px.pie(values=status_counts.values, names=status_counts.index, title="Attendance Status Distribution")
-    st.plotly_chart(fig1, key=f"status_distribution_{st.session_state.analytics_counter}")
+    st.plotly_chart(fig1, key=f"{key_prefix}_status_distribution")
     
     # Daily attendance trend
-    daily_counts = df.groupby(["Date", "Status"]).size().unstack().fillna(0)
+    daily_counts = status_df.pivot_table(index="Date", columns="Status", values="Count", aggfunc="sum", fill_value=0)
     fig2 = px.line(daily_counts, title="Daily Attendance Trend")
-    st.plotly_chart(fig2, key=f"daily_trend_{st.session_state.analytics_counter}")
+    st.plotly_chart(fig2, key=f"{key_prefix}_daily_trend")
     
     # Department-wise analysis
-    dept_data = []
-    for emp_id in df["EmployeeID"].unique():
-        emp = employees_col.find_one({"employeeId": emp_id})
-        if emp:
-            dept_data.append({
-                "EmployeeID": emp_id,
-                "Department": emp["department"]
-            })
-    
-    dept_df = pd.DataFrame(dept_data)
-    merged_df = pd.merge(df, dept_df, on="EmployeeID")
-    
-    dept_status = merged_df.groupby(["Department", "Status"]).size().unstack().fillna(0)
+    dept_status = load_department_status(start_date, end_date)
     fig3 = px.bar(dept_status, title="Department-wise Attendance")
-    st.plotly_chart(fig3, key=f"department_analysis_{st.session_state.analytics_counter}")
+    st.plotly_chart(fig3, key=f"{key_prefix}_department_analysis")
 
 def generate_pdf_report(employee_id, start_date, end_date):
     """Generate PDF attendance report for an employee"""
     # Get employee details
-    employee = employees_col.find_one({"employeeId": employee_id})
+    employee = employees_col.find_one(
+        {"employeeId": employee_id},
+        {"_id": 0, "empName": 1, "department": 1}
+    )
     if not employee:
         return None
     
-    # Get attendance records
-    attendance_records = list(attendance_col.find({
-        "date": {
-            "$gte": start_date.strftime("%Y-%m-%d"),
-            "$lte": end_date.strftime("%Y-%m-%d")
-        },
-        "employees.employeeId": employee_id
-    }))
+    # Get the employee's attendance rows, already shaped as table cells
+    attendance_records = list(attendance_col.aggregate([
+        {"$match": {
+            "date": date_range_filter(start_date, end_date),
+            "employees.employeeId": employee_id
+        }},
+        {"$sort": {"date": 1}},
+        {"$unwind": "$employees"},
+        {"$match": {"employees.employeeId": employee_id}},
+        {"$project": {
+            "_id": 0,
+            "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+            "status": "$employees.status",
+            "checkIn": {"$ifNull": ["$employees.checkIn", "N/A"]},
+            "checkOut": {"$ifNull": ["$employees.checkOut", "N/A"]}
+        }}
+    ]))
     
     # Create PDF
     buffer = io.BytesIO()
@@ -569,16 +877,10 @@ def generate_pdf_report(employee_id, start_date, end_date):
     
     # Add attendance table
     if attendance_records:
-        data = [["Date", "Status", "Check In", "Check Out"]]
-        for record in attendance_records:
-            for emp_record in record["employees"]:
-                if emp_record["employeeId"] == employee_id:
-                    data.append([
-                        record["date"],
-                        emp_record["status"],
-                        emp_record.get("checkIn", "N/A"),
-                        emp_record.get("checkOut", "N/A")
-                    ])
+        data = [
+            ["Date", "Status", "Check In", "Check Out"],
+            *([r["date"], r["status"], r["checkIn"], r["checkOut"]] for r in attendance_records)
+        ]
         
         table = Table(data)
         table.setStyle(TableStyle([
@@ -604,22 +906,16 @@ def generate_pdf_report(employee_id, start_date, end_date):
     buffer.seek(0)
     return buffer
 
-def download_attendance_report():
+def download_attendance_report(key_prefix):
     """UI for downloading attendance reports"""
     st.subheader("Download Attendance Report")
     
-    # Initialize session state for report if not exists
-    if 'report_counter' not in st.session_state:
-        st.session_state.report_counter = 0
-    st.session_state.report_counter += 1
-    
     # Employee selection
-    all_employees = list(employees_col.find())
-    employee_ids = [emp["employeeId"] for emp in all_employees]
+    employee_ids = load_employee_ids()
     selected_employee = st.selectbox(
         "Select Employee", 
         employee_ids, 
-        key=f"report_download_employee_{st.session_state.report_counter}"
+        key=f"{key_prefix}_report_download_employee"
     )
     
     # Date range selection
@@ -627,52 +923,40 @@ def download_attendance_report():
     start_date = col1.date_input(
         "Start Date", 
         date.today() - timedelta(days=30), 
-        key=f"report_download_start_date_{st.session_state.report_counter}"
+        key=f"{key_prefix}_report_download_start_date"
     )
     end_date = col2.date_input(
         "End Date", 
         date.today(), 
-        key=f"report_download_end_date_{st.session_state.report_counter}"
+        key=f"{key_prefix}_report_download_end_date"
     )
     
-    if st.button("Generate Report", key=f"generate_report_{st.session_state.report_counter}"):
+    if st.button("Generate Report", key=f"{key_prefix}_generate_report"):
         pdf_buffer = generate_pdf_report(selected_employee, start_date, end_date)
         if pdf_buffer:
-            employee = employees_col.find_one({"employeeId": selected_employee})
+            employee = employees_col.find_one({"employeeId": selected_employee}, {"_id": 0, "empName": 1})
             st.download_button(
                 label="Download PDF Report",
                 data=pdf_buffer,
                 file_name=f"attendance_report_{employee['empName']}_{start_date}_{end_date}.pdf",
                 mime="application/pdf",
-                key=f"download_report_{st.session_state.report_counter}"
+                key=f"{key_prefix}_download_report"
             )
         else:
             st.error("Failed to generate report")
 
 def check_missing_attendance():
     """Check for employees who haven't marked attendance today"""
-    today = date.today().strftime("%Y-%m-%d")
+    today = as_datetime(date.today())
     
     # Get today's attendance
-    today_attendance = attendance_col.find_one({"date": today})
+    today_attendance = attendance_col.find_one({"date": today}, {"_id": 0, "employees.employeeId": 1})
     if not today_attendance:
         return []
     
-    # Get all employees
-    all_employees = list(employees_col.find())
-    
     # Find employees who haven't marked attendance
-    missing_employees = []
-    for emp in all_employees:
-        found = False
-        for emp_record in today_attendance["employees"]:
-            if emp_record["employeeId"] == emp["employeeId"]:
-                found = True
-                break
-        if not found:
-            missing_employees.append(emp)
-    
-    return missing_employees
+    marked_ids = {emp_record["employeeId"] for emp_record in today_attendance["employees"]}
+    return [emp for emp in load_employees() if emp["employeeId"] not in marked_ids]
 
 def send_reminder_emails():
     """Send reminder emails to employees who haven't marked attendance"""
@@ -686,19 +970,26 @@ def send_reminder_emails():
     
     if st.button("Send Reminder Emails", key="send_reminders"):
         with st.spinner("Sending reminder emails..."):
-            for emp in missing_employees:
-                if emp.get("email"):
-                    subject = "Reminder: Mark Your Attendance"
-                    body = f"""Dear {emp['empName']},
+            recipients = [emp for emp in missing_employees if emp.get("email")]
+            messages = [
+                build_email(
+                    emp["email"],
+                    "Reminder: Mark Your Attendance",
+                    f"""Dear {emp['empName']},
 
 This is a reminder that you haven't marked your attendance for today. Please log in to the system and mark your attendance as soon as possible.
 
 Best regards,
 Attendance System"""
-                    
-                    if send_email(emp["email"], subject, body):
-                        st.success(f"Reminder sent to {emp['empName']}")
-                    time.sleep(1)  # Rate limiting
+                )
+                for emp in recipients
+            ]
+            
+            for emp, error in zip(recipients, send_emails(messages)):
+                if error is None:
+                    st.success(f"Reminder sent to {emp['empName']}")
+                else:
+                    st.error(f"Error sending email to {emp['empName']}: {error}")
 
 def main():
     """Main application function"""
@@ -720,6 +1011,10 @@ def main():
         st.sidebar.subheader("Auto Reminders")
         send_reminder_emails()
     
+    # Load the employee roster once per rerun and share it across tabs
+    all_employees = load_employees()
+    employee_ids = load_employee_ids()
+    
     # Create tabs based on user role
     if st.session_state.user_role == "admin":
         tabs = st.tabs([
@@ -745,8 +1040,8 @@ def main():
     if st.session_state.user_role == "admin":
         with tabs[0]:
             st.title("Admin Dashboard")
-            generate_attendance_analytics()
-            download_attendance_report()
+            generate_attendance_analytics("dashboard")
+            download_attendance_report("dashboard")
     
     # Employee Dashboard
     else:
@@ -755,14 +1050,14 @@ def main():
             # Show employee's recent attendance
             recent_attendance = list(attendance_col.find({
                 "employees.employeeId": st.session_state.current_user["employeeId"]
-            }).sort("date", -1).limit(5))
+            }, {"_id": 0, "date": 1, "employees.$": 1}).sort("date", -1).limit(5))
             
             if recent_attendance:
                 st.subheader("Recent Attendance")
                 for record in recent_attendance:
                     for emp_record in record["employees"]:
                         if emp_record["employeeId"] == st.session_state.current_user["employeeId"]:
-                            st.write(f"**Date:** {record['date']}")
+                            st.write(f"**Date:** {record['date'].strftime('%Y-%m-%d')}")
                             st.write(f"**Status:** {emp_record['status']}")
                             st.write(f"**Check In:** {emp_record.get('checkIn', 'N/A')}")
                             st.write(f"**Check Out:** {emp_record.get('checkOut', 'N/A')}")
@@ -778,17 +1073,15 @@ def main():
                 name = cols[1].text_input("Full Name*")
                 email = cols[0].text_input("Email*")
                 mobile = cols[1].text_input("Mobile Number*")
-                department = st.selectbox("Department*", 
-                                        ["HR", "IT", "Finance", "Operations", "Marketing"])
-                position = st.selectbox("Position*", 
-                                      ["Intern", "Junior", "Senior", "Manager", "Director"])
+                department = st.selectbox("Department*", DEPARTMENTS)
+                position = st.selectbox("Position*", POSITIONS)
                 
                 if st.form_submit_button("Add Employee"):
                     if not all([emp_id, name, email, mobile, department, position]):
                         st.error("Please fill all required fields!")
                     else:
-                        # Check if employee ID already exists
-                        if employees_col.find_one({"employeeId": emp_id}):
+                        # Check if employee ID already exists (a single probe on the unique index)
+                        if employees_col.count_documents({"employeeId": emp_id}, limit=1):
                             st.error(f"Employee ID {emp_id} already exists!")
                         else:
                             document = {
@@ -798,12 +1091,15 @@ def main():
                                 "mobile": mobile,
                                 "department": department,
                                 "position": position,
-                                "joinDate": datetime.now().strftime("%Y-%m-%d")
+                                "joinDate": date.today().isoformat()
                             }
                             try:
                                 employees_col.insert_one(document)
+                                clear_employee_caches()
                                 st.success(f"Employee {name} added successfully!")
                                 st.session_state.add_form_key += 1
+                            except DuplicateKeyError:
+                                st.error(f"Employee ID {emp_id} already exists!")
                             except Exception as e:
                                 st.error(f"Error adding employee: {e}")
     
@@ -811,137 +1107,177 @@ def main():
     with tabs[1 if st.session_state.user_role == "admin" else 0]:
         st.header("🖊️ Mark Attendance")
         
-        # Initialize session state for attendance if not exists
-        if 'attendance_counter' not in st.session_state:
-            st.session_state.attendance_counter = 0
-        st.session_state.attendance_counter += 1
-        
         # Face recognition attendance
         if st.checkbox(
             "Use Face Recognition", 
-            key=f"mark_attendance_face_recognition_{st.session_state.attendance_counter}"
+            key="mark_attendance_face_recognition"
         ):
             mark_attendance_by_face()
         else:
             # Manual attendance marking
-            attendance_date = st.date_input(
-                "Select Date", 
-                date.today(), 
-                key=f"mark_attendance_manual_date_{st.session_state.attendance_counter}"
+            backfill = st.checkbox(
+                "Backfill a date range",
+                key="mark_attendance_backfill"
             )
-            all_employees = list(employees_col.find())
+            if backfill:
+                col1, col2 = st.columns(2)
+                backfill_start = col1.date_input(
+                    "Start Date", 
+                    date.today() - timedelta(days=7), 
+                    key="mark_attendance_backfill_start"
+                )
+                backfill_end = col2.date_input(
+                    "End Date", 
+                    date.today(), 
+                    key="mark_attendance_backfill_end"
+                )
+                attendance_dates = [
+                    backfill_start + timedelta(days=i)
+                    for i in range((backfill_end - backfill_start).days + 1)
+                ]
+            else:
+                attendance_date = st.date_input(
+                    "Select Date", 
+                    date.today(), 
+                    key="mark_attendance_manual_date"
+                )
+                attendance_dates = [attendance_date]
             
             if not all_employees:
                 st.warning("No employees found in the database.")
+            elif not attendance_dates:
+                st.error("End date cannot be before start date")
             else:
-                existing_attendance = attendance_col.find_one({
-                    "date": attendance_date.strftime("%Y-%m-%d")
-                })
+                # Backfilled days that already exist are skipped on insert
+                existing_attendance = not backfill and attendance_col.count_documents({
+                    "date": as_datetime(attendance_date)
+                }, limit=1)
                 
                 if existing_attendance:
-                    st.warning(f"Attendance already marked for {attendance_date.strftime('%Y-%m-%d')}")
+                    st.warning(f"Attendance already marked for {attendance_date.isoformat()}")
                 else:
                     # Manual attendance form
-                    with st.form(key=f"manual_attendance_form_{st.session_state.attendance_counter}"):
-                        attendance_records = []
-                        for emp in all_employees:
-                            status = st.selectbox(
-                                f"Status for {emp['empName']}",
-                                ["Present", "Absent", "Leave", "Late"],
-                                key=f"status_{emp['employeeId']}"
-                            )
-                            attendance_records.append({
-                                "employeeId": emp["employeeId"],
-                                "status": status
-                            })
+                    with st.form(key="manual_attendance_form"):
+                        # One editable table instead of a selectbox per employee
+                        status_df = pd.DataFrame.from_records(
+                            all_employees,
+                            columns=["employeeId", "empName", "department"]
+                        ).assign(status="Present")
+                        edited_df = st.data_editor(
+                            status_df,
+                            column_config={
+                                "employeeId": "Employee ID",
+                                "empName": "Name",
+                                "department": "Department",
+                                "status": st.column_config.SelectboxColumn(
+                                    "Status",
+                                    options=ATTENDANCE_STATUSES,
+                                    required=True
+                                )
+                            },
+                            disabled=["employeeId", "empName", "department"],
+                            hide_index=True,
+                            num_rows="fixed",
+                            key="manual_attendance_editor"
+                        )
                         
                         if st.form_submit_button("Submit Attendance"):
-                            attendance_doc = {
-                                "date": attendance_date.strftime("%Y-%m-%d"),
-                                "markedAt": datetime.now(),
-                                "employees": attendance_records
-                            }
-                            attendance_col.insert_one(attendance_doc)
-                            st.success("Attendance marked successfully!")
+                            attendance_records = edited_df[["employeeId", "status"]].to_dict("records")
+                            # Skip days that are already marked up front rather than trusting
+                            # the unique date index, which may be missing on legacy data
+                            attendance_days = [as_datetime(attendance_day) for attendance_day in attendance_dates]
+                            marked_days = set(attendance_col.distinct("date", {"date": {"$in": attendance_days}}))
+                            marked_at = datetime.now()
+                            attendance_docs = [
+                                {
+                                    "date": attendance_day,
+                                    "markedAt": marked_at,
+                                    "employees": attendance_records
+                                }
+                                for attendance_day in attendance_days
+                                if attendance_day not in marked_days
+                            ]
+                            skipped = len(marked_days)
+                            failed = []
+                            if attendance_docs:
+                                try:
+                                    # Unordered so a day marked concurrently doesn't block the rest
+                                    attendance_col.insert_many(attendance_docs, ordered=False)
+                                except BulkWriteError as e:
+                                    write_errors = e.details["writeErrors"]
+                                    failed = [err for err in write_errors if err["code"] != 11000]
+                                    skipped += len(write_errors) - len(failed)
+                            inserted = len(attendance_days) - skipped - len(failed)
+                            
+                            if failed:
+                                st.error(f"Could not mark {len(failed)} day(s): {failed[0]['errmsg'][:200]}")
+                            if skipped:
+                                st.warning(f"Attendance marked for {inserted} day(s); {skipped} day(s) were already marked")
+                            elif not failed:
+                                st.success("Attendance marked successfully!")
+                            clear_attendance_caches()
     
     # View Attendance
     with tabs[2 if st.session_state.user_role == "admin" else 1]:
         st.header("📅 View Attendance Records")
         
-        # Initialize session state for view if not exists
-        if 'view_counter' not in st.session_state:
-            st.session_state.view_counter = 0
-        st.session_state.view_counter += 1
-        
         # Date range selection
         col1, col2 = st.columns(2)
         start_date = col1.date_input(
             "Start Date", 
             date.today() - timedelta(days=30), 
-            key=f"view_attendance_start_date_{st.session_state.view_counter}"
+            key="view_attendance_start_date"
         )
         end_date = col2.date_input(
             "End Date", 
             date.today(), 
-            key=f"view_attendance_end_date_{st.session_state.view_counter}"
+            key="view_attendance_end_date"
         )
         
         # Employee filter (admin only)
         if st.session_state.user_role == "admin":
-            all_employees = list(employees_col.find())
-            employee_ids = [emp["employeeId"] for emp in all_employees]
             selected_employee = st.selectbox(
                 "Filter by Employee (Optional)", 
-                [None] + employee_ids, 
-                key=f"view_attendance_employee_{st.session_state.view_counter}"
+                (None,) + employee_ids, 
+                key="view_attendance_employee"
             )
         else:
             selected_employee = st.session_state.current_user["employeeId"]
         
+        # Only query for inputs that were explicitly loaded; changing them hides the table again
+        query = (start_date, end_date, selected_employee)
         if st.button("Load Attendance", key="load_attendance"):
-            query = {
-                "date": {
-                    "$gte": start_date.strftime("%Y-%m-%d"),
-                    "$lte": end_date.strftime("%Y-%m-%d")
-                }
-            }
-            
-            if selected_employee:
-                query["employees.employeeId"] = selected_employee
-            
-            attendance_records = list(attendance_col.find(query).sort("date", 1))
+            st.session_state.view_attendance_query = query
+            st.session_state.view_attendance_page = 1
+        
+        if st.session_state.get("view_attendance_query") == query:
+            # Apply a page clamped on the previous run before the widget is created
+            if "view_attendance_page_clamped" in st.session_state:
+                st.session_state.view_attendance_page = st.session_state.pop("view_attendance_page_clamped")
+            page = st.number_input("Page", min_value=1, step=1, key="view_attendance_page")
+            df, total = load_attendance_rows(start_date, end_date, selected_employee, page)
             
-            if not attendance_records:
+            if total == 0:
                 st.info("No attendance records found for the selected criteria.")
             else:
-                # Process and display data
-                attendance_data = []
-                
-                for record in attendance_records:
-                    for emp_record in record["employees"]:
-                        if selected_employee and emp_record["employeeId"] != selected_employee:
-                            continue
-                            
-                        emp = employees_col.find_one({"employeeId": emp_record["employeeId"]})
-                        attendance_data.append({
-                            "Date": record["date"],
-                            "ID": emp_record["employeeId"],
-                            "Name": emp["empName"],
-                            "Department": emp["department"],
-                            "Status": emp_record["status"],
-                            "Check-in": emp_record.get("checkIn", "N/A"),
-                            "Check-out": emp_record.get("checkOut", "N/A")
-                        })
-                
-                df = pd.DataFrame(attendance_data)
-                st.dataframe(df, use_container_width=True)
+                n_pages = -(-total // ATTENDANCE_PAGE_SIZE)
+                if page > n_pages:
+                    # Past the end (e.g. records were removed); jump to the last page
+                    st.session_state.view_attendance_page_clamped = n_pages
+                    st.rerun()
+                st.dataframe(
+                    df,
+                    use_container_width=True,
+                    column_config={"Date": st.column_config.DateColumn("Date", format="YYYY-MM-DD")}
+                )
+                st.caption(f"Page {page} of {n_pages} ({total} records)")
     
     # Reports (Admin only)
     if st.session_state.user_role == "admin":
         with tabs[4]:
             st.header("📈 Reports")
-            generate_attendance_analytics()
-            download_attendance_report()
+            generate_attendance_analytics("reports")
+            download_attendance_report("reports")
     
     # Employee Management (Admin only)
     if st.session_state.user_role == "admin":
@@ -949,25 +1285,19 @@ def main():
             st.header("👥 Employee Management")
             # View all employees
             st.subheader("All Employees")
-            all_employees = list(employees_col.find())
             
             if not all_employees:
                 st.info("No employees found in the database.")
             else:
                 # Display employee table
-                emp_data = []
-                for emp in all_employees:
-                    emp_data.append({
-                        "ID": emp["employeeId"],
-                        "Name": emp["empName"],
-                        "Email": emp["email"],
-                        "Mobile": emp["mobile"],
-                        "Department": emp["department"],
-                        "Position": emp["position"],
-                        "Join Date": emp.get("joinDate", "N/A")
-                    })
+                emp_df = load_employees_df()
                 
-                st.dataframe(pd.DataFrame(emp_data), use_container_width=True)
+                # The roster is already cached for the selectboxes, so only page what is rendered
+                n_pages = -(-len(emp_df) // EMPLOYEE_PAGE_SIZE)
+                page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1, key="employee_table_page")
+                offset = (page - 1) * EMPLOYEE_PAGE_SIZE
+                st.dataframe(emp_df.iloc[offset:offset + EMPLOYEE_PAGE_SIZE], use_container_width=True)
+                st.caption(f"Page {page} of {n_pages} ({len(emp_df)} employees)")
             
             # Employee actions
             st.subheader("Employee Actions")
@@ -976,30 +1306,31 @@ def main():
             if action == "Promote Employee":
                 with st.form(key="promote_employee_form"):
                     emp_id = st.selectbox("Select Employee", employee_ids)
-                    new_position = st.selectbox("New Position", 
-                                              ["Intern", "Junior", "Senior", "Manager", "Director"])
+                    new_position = st.selectbox("New Position", POSITIONS)
                     
                     if st.form_submit_button("Promote"):
-                        result = employees_col.update_one(
+                        updated = employees_col.find_one_and_update(
                             {"employeeId": emp_id},
-                            {"$set": {"position": new_position}}
+                            {"$set": {"position": new_position}},
+                            projection={"_id": 1}
                         )
-                        if result.modified_count > 0:
+                        clear_employee_caches()
+                        if updated is not None:
                             st.success(f"Employee {emp_id} promoted to {new_position}!")
                         else:
-                            st.error("No changes made or employee not found")
+                            st.error("Employee not found")
             
             elif action == "Update Details":
                 with st.form(key="update_employee_form"):
                     emp_id = st.selectbox("Select Employee", employee_ids)
-                    emp = employees_col.find_one({"employeeId": emp_id})
+                    # Seed the form from the cached roster instead of another round-trip
+                    emp = next((e for e in all_employees if e["employeeId"] == emp_id), None)
                     
                     if emp:
                         new_email = st.text_input("Email", emp["email"])
                         new_mobile = st.text_input("Mobile", emp["mobile"])
-                        new_department = st.selectbox("Department", 
-                                                   ["HR", "IT", "Finance", "Operations", "Marketing"],
-                                                   index=["HR", "IT", "Finance", "Operations", "Marketing"].index(emp["department"]))
+                        new_department = st.selectbox("Department", DEPARTMENTS,
+                                                   index=DEPT_INDEX.get(emp["department"], 0))
                         
                         if st.form_submit_button("Update"):
                             update_data = {
@@ -1007,14 +1338,16 @@ def main():
                                 "mobile": new_mobile,
                                 "department": new_department
                             }
-                            result = employees_col.update_one(
+                            updated = employees_col.find_one_and_update(
                                 {"employeeId": emp_id},
-                                {"$set": update_data}
+                                {"$set": update_data},
+                                projection={"_id": 1}
                             )
-                            if result.modified_count > 0:
+                            clear_employee_caches()
+                            if updated is not None:
                                 st.success(f"Employee {emp_id} details updated!")
                             else:
-                                st.error("No changes made or employee not found")
+                                st.error("Employee not found")
             
             elif action == "Remove Employee":
                 with st.form(key="remove_employee_form"):
@@ -1022,9 +1355,10 @@ def main():
                     
                     if st.form_submit_button("Remove"):
                         # Check if employee has attendance records
-                        has_attendance = attendance_col.count_documents({
-                            "employees.employeeId": emp_id
-                        }) > 0
+                        has_attendance = attendance_col.count_documents(
+                            {"employees.employeeId": emp_id},
+                            limit=1
+                        ) > 0
                         
                         if has_attendance:
                             st.warning("This employee has attendance records. Deleting will remove all associated data.")
@@ -1033,11 +1367,9 @@ def main():
                                 st.stop()
                         
                         # Delete employee and their attendance records
-                        employees_col.delete_one({"employeeId": emp_id})
-                        attendance_col.update_many(
-                            {},
-                            {"$pull": {"employees": {"employeeId": emp_id}}}
-                        )
+                        remove_employee(emp_id)
+                        clear_employee_caches()
+                        clear_attendance_caches()
                         st.success(f"Employee {emp_id} removed successfully!")
     
     # Leave Management
@@ -1055,13 +1387,11 @@ def main():
     with tabs[-1]:
         st.header("📸 Face Registration")
         if st.session_state.user_role == "admin":
-            all_employees = list(employees_col.find())
-            employee_ids = [emp["employeeId"] for emp in all_employees]
             selected_employee = st.selectbox("Select Employee", employee_ids)
-            if st.button("Register Face", key="register_face_admin"):
+            if st.checkbox("Register Face", key="register_face_admin"):
                 register_face(selected_employee)
         else:
-            if st.button("Register My Face", key="register_face_employee"):
+            if st.checkbox("Register My Face", key="register_face_employee"):
                 register_face(st.session_state.current_user["employeeId"])
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+from dotenv import load_dotenv
+from datetime import datetime
+import os
+from mongo_utils import MongoDBClient
+
+# One-time migration: attendance dates used to be stored as "YYYY-MM-DD"
+# strings and are now stored as BSON dates (midnight of the attendance day).
+
+def migrate_attendance_dates(db):
+    """Convert string attendance dates to BSON dates, returning (converted, conflicts)"""
+    attendance = db["attendance"]
+    converted = 0
+    conflicts = []
+    for doc in attendance.find({"date": {"$type": "string"}}, {"date": 1, "employees": 1}):
+        try:
+            day = datetime.strptime(doc["date"], "%Y-%m-%d")
+        except ValueError:
+            conflicts.append(f"{doc['_id']}: unparseable date {doc['date']!r}, left as is")
+            continue
+
+        # The app may already have written a BSON-dated document for this day; merge
+        # into it (its entries win) rather than violate the unique date index
+        existing = attendance.find_one({"date": day}, {"employees.employeeId": 1})
+        if existing is None:
+            attendance.update_one({"_id": doc["_id"]}, {"$set": {"date": day}})
+            converted += 1
+            continue
+
+        marked = {emp["employeeId"] for emp in existing.get("employees", [])}
+        legacy = doc.get("employees", [])
+        missing = [emp for emp in legacy if emp["employeeId"] not in marked]
+        if missing:
+            attendance.update_one({"_id": existing["_id"]}, {"$push": {"employees": {"$each": missing}}})
+        attendance.delete_one({"_id": doc["_id"]})
+        conflicts.append(
+            f"{doc['date']}: merged {len(missing)} entries into the existing document, "
+            f"dropped {len(legacy) - len(missing)} already marked there"
+        )
+    return converted, conflicts
+
+if __name__ == "__main__":
+    load_dotenv()
+    mongo = MongoDBClient(os.getenv("MONGO_URI"), os.getenv("DB_NAME"))
+    mongo.connect()
+    count, conflicts = migrate_attendance_dates(mongo.db)
+    print(f"✅ Migrated {count} attendance documents")
+    for conflict in conflicts:
+        print(f"⚠️ {conflict}")
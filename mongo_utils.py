@@ -1,31 +1,40 @@
-from pymongo import MongoClient
-import urllib.parse
-
-class MongoDBClient:
-    def __init__(self, uri, db_name):
-        self.uri = uri
-        self.db_name = db_name
-        
-    def connect(self):
-        try:
-            # Auto-encode password if not already encoded
-            if "@" in self.uri:
-                protocol, rest = self.uri.split("@", 1)
-                creds_part = protocol.split("//")[1]
-                username, password = creds_part.split(":", 1)
-                if "%" not in password:  # Only encode if not already encoded
-                    encoded_password = urllib.parse.quote_plus(password)
-                    self.uri = self.uri.replace(password, encoded_password)
-
-            self.client = MongoClient(
-                self.uri,
-                serverSelectionTimeoutMS=10000,  # 10-second timeout
-                socketTimeoutMS=30000
-            )
-            self.db = self.client[self.db_name]
-            self.client.admin.command('ping')  # Test connection
-            print("✅ MongoDB connected!")
-            return True
-        except Exception as e:
-            print(f"❌ Connection failed: {str(e)[:200]}...")
-            raise
+from pymongo import MongoClient
+import urllib.parse
+
+def _normalize_uri(uri):
+    """Percent-encode the password in a MongoDB URI unless it is already encoded"""
+    scheme, sep, rest = uri.partition("://")
+    # The host list can't contain "@", so the last one ends the userinfo even when the
+    # password contains "@", "/", "?" or "#"; the path and query stay with the hosts
+    userinfo, at, hosts = rest.rpartition("@")
+    if not sep or not at:
+        return uri
+    username, has_password, password = userinfo.partition(":")
+    if not has_password or "%" in password:  # Only encode if not already encoded
+        return uri
+    encoded_password = urllib.parse.quote_plus(password)
+    return f"{scheme}://{username}:{encoded_password}@{hosts}"
+
+class MongoDBClient:
+    def __init__(self, uri, db_name):
+        self.uri = _normalize_uri(uri)
+        self.db_name = db_name
+        self.client = None
+
+    def connect(self):
+        if self.client is not None:  # Already connected
+            return True
+        try:
+            client = MongoClient(
+                self.uri,
+                serverSelectionTimeoutMS=10000,  # 10-second timeout
+                socketTimeoutMS=30000
+            )
+            client.admin.command('ping')  # Test connection
+            self.client = client
+            self.db = client[self.db_name]
+            print("✅ MongoDB connected!")
+            return True
+        except Exception as e:
+            print(f"❌ Connection failed: {str(e)[:200]}...")
+            raise